@@ -21,10 +21,10 @@ if %errorlevel% neq 0 (
     exit /b 1
 )
 
-REM Run the conversion script
+REM Run the conversion script, passing on options such as --memory-budget-mb 512
 echo.
 echo Running conversion script...
-python pdf_to_structured_text.py
+python pdf_to_structured_text.py %*
 if %errorlevel% neq 0 (
     echo Conversion failed. Please check the error message above.
     pause
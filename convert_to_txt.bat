@@ -20,8 +20,8 @@ echo This may take several minutes for large files.
 echo Files larger than 2MB will be automatically split into multiple parts.
 echo.
 
-REM Run the conversion script
-python convert_to_txt.py
+REM Run the conversion script, passing on options such as --memory-budget-mb 512
+python convert_to_txt.py %*
 if %errorlevel% neq 0 (
     echo.
     echo Conversion failed. Please check the error message above.
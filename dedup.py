@@ -0,0 +1,229 @@
+import re
+import json
+import difflib
+import hashlib
+
+# Minimum share of common networks (Jaccard index) before two blocks are
+# compared line by line as near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.5
+
+# A diff is only emitted when it is clearly smaller than the block itself
+MAX_DIFF_RATIO = 0.5
+
+def content_hash(text):
+    """Return a stable fingerprint for a piece of text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def file_hash(file_path):
+    """Return a fingerprint of the raw bytes of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# First line of the body written in place of a duplicate or near-duplicate block
+REFERENCE_MARKERS = {
+    'duplicate': "// DUPLICATE:",
+    'near_duplicate': "// NEAR-DUPLICATE:",
+}
+
+def corpus_name(block_type, stem):
+    """Return the base name a block gets in the flattened .txt corpus."""
+    # Matches the names written by convert_st_to_txt_files (NAME.txt or NAME_partNN.txt)
+    return f"{block_type}_{stem}"
+
+def describe_reference(name):
+    """Describe where a referenced block can be found in the .txt corpus."""
+    return f"{name}.txt or its _partNN.txt files if split"
+
+def split_metadata_header(text):
+    """Split a converted file into its conversion header and its body."""
+    # The header is framed by two "// ====" lines (see convert_pdf_to_structured_text)
+    match = re.match(r'// =+\n.*?\n// =+\n\n?', text, re.DOTALL)
+    if match:
+        return text[:match.end()], text[match.end():]
+    return "", text
+
+def parse_reference(body):
+    """Return (status, reference) if a body is a reference written by deduplication, else None."""
+    for status, marker in REFERENCE_MARKERS.items():
+        if body.startswith(marker):
+            # Block names may contain spaces, e.g. "FBs_Motor (FB)"
+            match = re.match(r'\S+ (?:identical to|based on) (.+?)\.txt or its _partNN\.txt files', body[len("// "):])
+            return status, match.group(1) if match else None
+    return None
+
+# Rule line framing the conversion header of a .st file
+HEADER_RULE = re.compile(r'// =+\n')
+
+# Longest conversion header expected before its closing rule line
+MAX_HEADER_LINES = 50
+
+def hash_converted_file(file_path):
+    """Hash the body of a converted file line by line, without loading it whole.
+
+    Returns (header, digest, reference) where header is the conversion header
+    (empty if there is none), digest the hash of the body and reference the
+    parse_reference result for the body.
+    """
+    for encoding in ('utf-8', 'latin1'):
+        try:
+            with open(file_path, 'r', encoding=encoding) as f:
+                header_lines = []
+                line = f.readline()
+                if HEADER_RULE.fullmatch(line):
+                    header_lines.append(line)
+                    while len(header_lines) < MAX_HEADER_LINES:
+                        line = f.readline()
+                        header_lines.append(line)
+                        if not line or HEADER_RULE.fullmatch(line):
+                            break
+                
+                if len(header_lines) > 2 and HEADER_RULE.fullmatch(header_lines[-1]):
+                    # Skip the blank line written after the header
+                    line = f.readline()
+                    if line == "\n":
+                        header_lines.append(line)
+                        line = f.readline()
+                    header = "".join(header_lines)
+                    first_line = line
+                else:
+                    # No complete header, so everything read so far is body
+                    header = ""
+                    first_line = "".join(header_lines) or line
+                
+                digest = hashlib.sha256(first_line.encode('utf-8'))
+                for line in f:
+                    digest.update(line.encode('utf-8'))
+                return header, digest.hexdigest(), parse_reference(first_line)
+        except UnicodeDecodeError:
+            # Try with a different encoding if utf-8 fails
+            continue
+
+def split_networks(content):
+    """Split rendered block content into the interface part and its networks."""
+    return [chunk for chunk in re.split(r'(?m)^(?=NETWORK \d+:)', content) if chunk.strip()]
+
+def create_dedup_map():
+    """Create an empty dedup map to be shared across one conversion run.
+
+    Only fingerprints are kept, never block contents, so the map stays small
+    however large the blocks are.
+    """
+    return {
+        'blocks': {},          # block name -> dedup entry (written to the report)
+        'hashes': {},          # content hash -> first block name with that content
+        'networks': {},        # network hash -> list of block names containing it
+        'network_hashes': {},  # block name -> set of network hashes
+    }
+
+def fingerprint_block(content):
+    """Return the fingerprint deduplicate_block needs for a rendered block."""
+    return {
+        'hash': content_hash(content),
+        'size': len(content.encode('utf-8')),
+        'network_hashes': {content_hash(network) for network in split_networks(content)},
+    }
+
+def find_near_duplicate(dedup_map, network_hashes, group):
+    """Find the registered block sharing the most networks with a new block."""
+    shared_counts = {}
+    for network in network_hashes:
+        for name in dedup_map['networks'].get(network, []):
+            if dedup_map['blocks'][name]['group'] == group:
+                shared_counts[name] = shared_counts.get(name, 0) + 1
+
+    best_name = None
+    best_score = 0.0
+    for name, shared in shared_counts.items():
+        union = len(network_hashes | dedup_map['network_hashes'][name])
+        score = shared / union if union else 0.0
+        if score > best_score:
+            best_name = name
+            best_score = score
+
+    if best_score < NEAR_DUPLICATE_THRESHOLD:
+        return None, best_score
+    return best_name, best_score
+
+def deduplicate_block(dedup_map, name, fingerprint, load_content, group=None):
+    """Register a rendered block and decide how it should be stored.
+
+    fingerprint comes from fingerprint_block and load_content(name) returns
+    the rendered content of a registered block; it is only called to diff
+    near-duplicates. Returns (entry, diff): the entry's 'status' is 'unique',
+    'duplicate' (identical to 'reference') or 'near_duplicate', in which case
+    diff holds a unified diff against 'reference'.
+    """
+    digest = fingerprint['hash']
+    entry = {'hash': digest, 'group': group, 'status': 'unique', 'size': fingerprint['size']}
+
+    if digest in dedup_map['hashes']:
+        entry['status'] = 'duplicate'
+        entry['reference'] = dedup_map['hashes'][digest]
+        dedup_map['blocks'][name] = entry
+        return entry, None
+
+    network_hashes = fingerprint['network_hashes']
+    reference, similarity = find_near_duplicate(dedup_map, network_hashes, group)
+    if reference:
+        diff_lines = difflib.unified_diff(
+            load_content(reference).splitlines(),
+            load_content(name).splitlines(),
+            fromfile=f"{reference} (block body)",
+            tofile=f"{name} (block body)",
+            lineterm='',
+        )
+        diff = "\n".join(diff_lines)
+        diff_size = len(diff.encode('utf-8'))
+        if diff_size < fingerprint['size'] * MAX_DIFF_RATIO:
+            entry['status'] = 'near_duplicate'
+            entry['reference'] = reference
+            entry['similarity'] = round(similarity, 3)
+            entry['diff_size'] = diff_size
+            dedup_map['blocks'][name] = entry
+            return entry, diff
+
+    # Only unique blocks become references for later blocks
+    dedup_map['hashes'][digest] = name
+    dedup_map['network_hashes'][name] = network_hashes
+    for network in network_hashes:
+        dedup_map['networks'].setdefault(network, []).append(name)
+    dedup_map['blocks'][name] = entry
+    return entry, None
+
+def render_dedup_reference(entry, diff=None):
+    """Render the body stored in place of a duplicate or near-duplicate block."""
+    if entry['status'] == 'duplicate':
+        return (f"{REFERENCE_MARKERS['duplicate']} identical to {describe_reference(entry['reference'])}\n"
+                f"// Content hash: {entry['hash']}\n")
+
+    rendered = (f"{REFERENCE_MARKERS['near_duplicate']} based on {describe_reference(entry['reference'])} "
+                f"(network similarity {entry['similarity']:.0%})\n"
+                f"// Content hash: {entry['hash']}\n"
+                f"// Differences to the referenced block (unified diff). Line numbers count from the first\n"
+                f"// line of the block body, after the metadata header and any part header of the file.\n\n")
+    return rendered + diff + "\n"
+
+def write_dedup_map(dedup_map, report_path):
+    """Write the dedup map as a JSON report and print a short summary."""
+    blocks = {}
+    for name, entry in dedup_map['blocks'].items():
+        blocks[name] = {key: value for key, value in entry.items() if key != 'group'}
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'blocks': blocks}, f, indent=2)
+
+    duplicates = sum(1 for entry in blocks.values() if entry['status'] == 'duplicate')
+    near_duplicates = sum(1 for entry in blocks.values() if entry['status'] == 'near_duplicate')
+    saved = sum(entry['size'] for entry in dedup_map['blocks'].values() if entry['status'] == 'duplicate')
+    saved += sum(entry['size'] - entry['diff_size']
+                 for entry in dedup_map['blocks'].values() if entry['status'] == 'near_duplicate')
+
+    failed = sum(1 for entry in blocks.values() if entry['status'] == 'failed')
+
+    print(f"Dedup: {len(blocks)} blocks, {duplicates} duplicates, {near_duplicates} near-duplicates "
+          f"({saved / (1024 * 1024):.2f} MB saved), map written to {report_path}")
+    if failed:
+        print(f"Dedup: {failed} blocks failed to convert, marked as 'failed' in the map")
@@ -1,8 +1,18 @@
 import os
 import re
+import argparse
 import datetime
 import PyPDF2
 from pathlib import Path
+from dedup import (corpus_name, create_dedup_map, deduplicate_block, file_hash, fingerprint_block,
+                   render_dedup_reference, split_metadata_header, write_dedup_map)
+from scheduler import DEFAULT_MEMORY_BUDGET_MB, add_scheduler_arguments, run_job, run_scheduled_jobs
+
+# Rough memory needed per PDF page for the parsed page and its extracted text
+PDF_BYTES_PER_PAGE = 64 * 1024
+
+# The PLC tags table is converted by process_plc_tags_file instead of as a block
+PLC_TAGS_FILENAME = "PLC tags.pdf"
 
 def extract_text_from_pdf(pdf_path):
     """Extract text content from a PDF file."""
@@ -366,83 +376,185 @@ def process_data_block(text):
     structured_db += "}\n"
     return structured_db
 
-def convert_pdf_to_structured_text(pdf_dir, output_dir):
-    """Convert PDF files to structured text format."""
+def estimate_pdf_cost(pdf_file):
+    """Estimate the memory needed to convert a PDF from its size and page count."""
+    file_size = os.path.getsize(pdf_file)
+    try:
+        with open(pdf_file, 'rb') as file:
+            page_count = len(PyPDF2.PdfReader(file).pages)
+    except Exception as e:
+        print(f"Error counting pages of {pdf_file}: {str(e)}")
+        page_count = 0
+    return file_size + page_count * PDF_BYTES_PER_PAGE
+
+def write_structured_text_file(output_file, pdf_file, block_type, metadata, content):
+    """Write a converted block with its metadata header."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        # Add metadata header
+        f.write(f"// ============================================================================\n")
+        f.write(f"// Converted from: {pdf_file.name}\n")
+        f.write(f"// Conversion date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"// Block type: {block_type}\n")
+        
+        # Write metadata if available
+        for key, value in metadata.items():
+            f.write(f"// {key.capitalize()}: {value}\n")
+        
+        f.write(f"// ============================================================================\n\n")
+        
+        # Write the processed content
+        f.write(content)
+
+def convert_pdf_to_structured_text(pdf_dir, output_dir, dedup=True, max_workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Convert PDF files to structured text format.
+    
+    With dedup enabled, byte-identical PDFs are only converted once and blocks
+    whose content repeats an earlier block are stored as a reference (plus a
+    diff for near-duplicates). The dedup map is written to dedup_map.json.
+    
+    PDFs are converted in parallel, largest first, keeping the estimated memory
+    of the PDFs being converted at once within memory_budget_mb. The PLC tags
+    file, if present, is scheduled the same way but converted by
+    process_plc_tags_file.
+    """
     pdf_dir_path = Path(pdf_dir)
     output_dir_path = Path(output_dir)
     
     if not output_dir_path.exists():
         output_dir_path.mkdir(parents=True)
     
-    for pdf_file in pdf_dir_path.glob("*.pdf"):
-        print(f"Processing {pdf_file.name}...")
-        
-        # Extract text from PDF
-        raw_text = extract_text_from_pdf(pdf_file)
-        
-        # Clean the text
-        cleaned_text = clean_text(raw_text)
-        
-        # Identify block type and determine output directory
+    dedup_map = create_dedup_map()
+    pdf_groups = {}  # PDF file hash -> byte-identical PDFs, converted only once
+    
+    for pdf_file in sorted(pdf_dir_path.glob("*.pdf")):
+        if pdf_file.name == PLC_TAGS_FILENAME:
+            continue
+        pdf_hash = file_hash(pdf_file) if dedup else str(pdf_file)
+        pdf_groups.setdefault(pdf_hash, []).append(pdf_file)
+    
+    # Jobs are named after the PDF that is converted, which stands for its whole group
+    groups_by_job = {pdf_files[0].name: pdf_files for pdf_files in pdf_groups.values()}
+    
+    jobs = []
+    for job_name, pdf_files in groups_by_job.items():
+        pdf_file = pdf_files[0]
         block_type = identify_block_type(pdf_file.name)
         output_subdir = output_dir_path / block_type
         
         if not output_subdir.exists():
             output_subdir.mkdir(parents=True)
         
-        # Extract metadata from the text
-        metadata = extract_block_metadata(cleaned_text)
+        output_file = output_subdir / f"{pdf_file.stem}.st"
+        jobs.append((job_name, estimate_pdf_cost(pdf_file), (convert_pdf_block, pdf_file, block_type, output_file)))
+    
+    # The tags file is often the largest PDF, so it goes through the scheduler like the blocks
+    plc_tags_path = pdf_dir_path / PLC_TAGS_FILENAME
+    if plc_tags_path.exists():
+        jobs.append((PLC_TAGS_FILENAME, estimate_pdf_cost(plc_tags_path), (process_plc_tags_file, plc_tags_path, output_dir_path)))
+    
+    # Workers write the full block themselves and only send back its metadata and
+    # fingerprint, so no block content has to be held in this process
+    results = {}
+    run_scheduled_jobs(jobs, run_job, results.__setitem__, max_workers, memory_budget_mb)
+    
+    if dedup:
+        deduplicate_converted_blocks(output_dir_path, groups_by_job, results, dedup_map)
+        write_dedup_map(dedup_map, output_dir_path / "dedup_map.json")
+
+def convert_pdf_block(pdf_file, block_type, output_file):
+    """Convert one PDF to its .st file, returning (metadata, fingerprint) of the block."""
+    metadata, content = render_pdf_block(pdf_file, block_type)
+    write_structured_text_file(output_file, pdf_file, block_type, metadata, content)
+    print(f"Converted {pdf_file.name} to {output_file}")
+    return metadata, fingerprint_block(content)
+
+def deduplicate_converted_blocks(output_dir_path, groups_by_job, results, dedup_map):
+    """Replace repeated blocks by references, in file name order so the outcome is stable."""
+    output_files = {}  # corpus name -> .st file holding the full block
+    
+    def load_content(name):
+        with open(output_files[name], 'r', encoding='utf-8') as f:
+            return split_metadata_header(f.read())[1]
+    
+    for job_name, pdf_files in sorted(groups_by_job.items()):
+        if job_name not in results:
+            # The conversion failed, the error has already been reported
+            continue
+        metadata, fingerprint = results[job_name]
         
-        # Process content based on block type
-        if block_type == "DBs":
-            # Handle data blocks differently
-            content = process_data_block(cleaned_text)
-        else:
-            # Extract interface section for non-DB blocks
-            interface_section = extract_interface_section(cleaned_text)
+        # Only the first of a group of byte-identical PDFs was converted, so the group is
+        # deduplicated once and the other PDFs reuse that outcome
+        first_name = None
+        for pdf_file in pdf_files:
+            block_type = identify_block_type(pdf_file.name)
+            name = corpus_name(block_type, pdf_file.stem)
+            output_subdir = output_dir_path / block_type
             
-            # Process network structure for non-DB blocks
-            networks_section = process_network_structure(cleaned_text)
+            if not output_subdir.exists():
+                output_subdir.mkdir(parents=True)
             
-            # Format LAD/FBD diagrams for readability
-            content = format_lad_fbd_diagrams(networks_section)
+            output_file = output_subdir / f"{pdf_file.stem}.st"
             
-            # Prepend interface section if available
-            if interface_section:
-                if 'language' in metadata and metadata['language'] in ['SCL', 'ST']:
-                    # For SCL/ST blocks
-                    full_content = "VAR\n"
-                    full_content += interface_section
-                    full_content += "END_VAR\n\n"
-                    full_content += content
-                    content = full_content
-                else:
-                    # For LAD/FBD/STL blocks
-                    full_content = "INTERFACE\n"
-                    full_content += interface_section
-                    full_content += "END_INTERFACE\n\n"
-                    full_content += content
-                    content = full_content
-        
-        # Save to file
-        output_file = output_subdir / f"{pdf_file.stem}.st"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            # Add metadata header
-            f.write(f"// ============================================================================\n")
-            f.write(f"// Converted from: {pdf_file.name}\n")
-            f.write(f"// Conversion date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"// Block type: {block_type}\n")
-            
-            # Write metadata if available
-            for key, value in metadata.items():
-                f.write(f"// {key.capitalize()}: {value}\n")
-            
-            f.write(f"// ============================================================================\n\n")
+            if first_name is None:
+                first_name = name
+                output_files[name] = output_file
+                entry, diff = deduplicate_block(dedup_map, name, fingerprint, load_content, group=block_type)
+            elif dedup_map['blocks'][first_name]['status'] == 'unique':
+                entry = dict(dedup_map['blocks'][first_name], status='duplicate', reference=first_name)
+                dedup_map['blocks'][name] = entry
+            else:
+                entry = dict(dedup_map['blocks'][first_name])
+                dedup_map['blocks'][name] = entry
             
-            # Write the processed content
-            f.write(content)
+            if entry['status'] != 'unique':
+                write_structured_text_file(output_file, pdf_file, block_type, metadata, render_dedup_reference(entry, diff))
+                print(f"Replaced {output_file} by a reference to {entry['reference']} ({entry['status'].replace('_', '-')})")
+
+def render_pdf_block(pdf_file, block_type):
+    """Extract a PDF and render its block content, returning (metadata, content)."""
+    print(f"Processing {pdf_file.name}...")
+    
+    # Extract text from PDF
+    raw_text = extract_text_from_pdf(pdf_file)
+    
+    # Clean the text
+    cleaned_text = clean_text(raw_text)
+    
+    # Extract metadata from the text
+    metadata = extract_block_metadata(cleaned_text)
+    
+    # Process content based on block type
+    if block_type == "DBs":
+        # Handle data blocks differently
+        content = process_data_block(cleaned_text)
+    else:
+        # Extract interface section for non-DB blocks
+        interface_section = extract_interface_section(cleaned_text)
+        
+        # Process network structure for non-DB blocks
+        networks_section = process_network_structure(cleaned_text)
         
-        print(f"Converted {pdf_file.name} to {output_file}")
+        # Format LAD/FBD diagrams for readability
+        content = format_lad_fbd_diagrams(networks_section)
+        
+        # Prepend interface section if available
+        if interface_section:
+            if 'language' in metadata and metadata['language'] in ['SCL', 'ST']:
+                # For SCL/ST blocks
+                full_content = "VAR\n"
+                full_content += interface_section
+                full_content += "END_VAR\n\n"
+                full_content += content
+                content = full_content
+            else:
+                # For LAD/FBD/STL blocks
+                full_content = "INTERFACE\n"
+                full_content += interface_section
+                full_content += "END_INTERFACE\n\n"
+                full_content += content
+                content = full_content
+    
+    return metadata, content
 
 def process_plc_tags_file(pdf_path, output_dir):
     """Special processing for PLC tags PDF file."""
@@ -519,11 +631,11 @@ if __name__ == "__main__":
     PDF_DIRECTORY = "TIA_PDFS"
     OUTPUT_DIRECTORY = "ConvertedProgram"
     
-    # Process the PLC tags file separately if it exists
-    plc_tags_path = Path(PDF_DIRECTORY) / "PLC tags.pdf"
-    if plc_tags_path.exists():
-        process_plc_tags_file(plc_tags_path, OUTPUT_DIRECTORY)
+    parser = argparse.ArgumentParser(description="Convert PLC program PDFs to structured text.")
+    add_scheduler_arguments(parser)
+    args = parser.parse_args()
     
-    # Process the rest of the PDF files
-    convert_pdf_to_structured_text(PDF_DIRECTORY, OUTPUT_DIRECTORY)
+    # Process the PDF files, including the PLC tags file if it exists
+    convert_pdf_to_structured_text(PDF_DIRECTORY, OUTPUT_DIRECTORY, max_workers=args.max_workers,
+                                   memory_budget_mb=args.memory_budget_mb)
     print("Conversion completed!")
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# Default cap on the estimated memory of all jobs running at the same time
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# ProcessPoolExecutor rejects more than 61 workers on Windows
+WINDOWS_MAX_WORKERS = 61
+
+def add_scheduler_arguments(parser):
+    """Add the worker count and memory budget options to a command line parser.
+
+    Their defaults come from the PLC_MAX_WORKERS and PLC_MEMORY_BUDGET_MB
+    environment variables, so they can also be set for the .bat files.
+    """
+    parser.add_argument('--max-workers', type=int, default=int(os.environ.get('PLC_MAX_WORKERS', 0)) or None,
+                        help="number of worker processes (default: PLC_MAX_WORKERS or the number of CPUs)")
+    parser.add_argument('--memory-budget-mb', type=float,
+                        default=float(os.environ.get('PLC_MEMORY_BUDGET_MB', DEFAULT_MEMORY_BUDGET_MB)),
+                        help=f"cap on the estimated memory of files converted at the same time "
+                             f"(default: PLC_MEMORY_BUDGET_MB or {DEFAULT_MEMORY_BUDGET_MB})")
+
+def run_job(function, *args):
+    """Worker for jobs that each name their own function as the first argument."""
+    return function(*args)
+
+def format_duration(seconds):
+    """Format a number of seconds as H:MM:SS."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def pick_next_job(pending, in_flight_count, in_flight_bytes, memory_budget, run_alone):
+    """Return the index of the largest pending job that fits in the memory budget.
+
+    Pending jobs are sorted largest first. A job larger than the whole budget,
+    or one that was running when a worker process died, is only started when
+    nothing else is running, so it never shares memory; until then no smaller
+    jobs are started ahead of it.
+    """
+    for index, (name, _, _) in enumerate(pending):
+        if name in run_alone:
+            return index if in_flight_count == 0 else None
+    if pending and pending[0][1] > memory_budget:
+        return 0 if in_flight_count == 0 else None
+    for index, (_, cost, _) in enumerate(pending):
+        if in_flight_bytes + cost <= memory_budget:
+            return index
+    return None
+
+def run_scheduled_jobs(jobs, worker, on_result=None, max_workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Run jobs in worker processes, largest first, within a memory budget.
+
+    jobs is a list of (name, estimated_bytes, args) tuples; worker(*args) is run
+    for each job and on_result(name, result) is called in this process as jobs
+    finish. The estimated bytes drive both the ordering and the budget, and the
+    queue depth and ETA are printed after every finished job.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if sys.platform == 'win32':
+        max_workers = min(max_workers, WINDOWS_MAX_WORKERS)
+    memory_budget = int(memory_budget_mb * 1024 * 1024)
+
+    # Start the largest jobs first so a giant file does not finish last on its own
+    pending = sorted(jobs, key=lambda job: job[1], reverse=True)
+    total_cost = sum(cost for _, cost, _ in pending) or 1
+    total_jobs = len(pending)
+
+    print(f"Scheduling {total_jobs} jobs ({total_cost / (1024 * 1024):.2f} MB estimated) "
+          f"on {max_workers} workers with a {memory_budget_mb} MB memory budget")
+
+    in_flight = {}  # future -> (name, cost, args)
+    in_flight_bytes = 0
+    done_cost = 0
+    done_jobs = 0
+    run_alone = set()  # jobs that were running when a worker process died
+    start_time = time.time()
+
+    def report_progress():
+        # Estimate the remaining time from the throughput so far
+        elapsed = time.time() - start_time
+        eta = elapsed / done_cost * (total_cost - done_cost) if done_cost else 0
+        print(f"[{done_jobs}/{total_jobs}] queue depth: {len(pending)}, running: {len(in_flight)} "
+              f"({in_flight_bytes / (1024 * 1024):.1f} MB), elapsed {format_duration(elapsed)}, "
+              f"ETA {format_duration(eta)}")
+
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or in_flight:
+            # Fill free workers with the largest jobs the budget allows
+            while pending and len(in_flight) < max_workers:
+                if any(name in run_alone for name, _, _ in in_flight.values()):
+                    break
+                index = pick_next_job(pending, len(in_flight), in_flight_bytes, memory_budget, run_alone)
+                if index is None:
+                    break
+                name, cost, args = pending.pop(index)
+                in_flight[executor.submit(worker, *args)] = (name, cost, args)
+                in_flight_bytes += cost
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                # A worker died (e.g. killed for running out of memory) and took the pool with it
+                finished, _ = wait(in_flight)
+
+            lost = []
+            for future in finished:
+                name, cost, args = in_flight.pop(future)
+                in_flight_bytes -= cost
+
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    lost.append((name, cost, args))
+                    continue
+                except Exception as e:
+                    print(f"Error processing {name}: {str(e)}")
+                else:
+                    if on_result:
+                        on_result(name, result)
+
+                done_cost += cost
+                done_jobs += 1
+                report_progress()
+
+            if lost:
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+                if len(lost) == 1:
+                    # The job was running on its own, so it is the one that killed the worker
+                    name, cost, _ = lost[0]
+                    print(f"Error processing {name}: worker process died (possibly out of memory), skipping it")
+                    done_cost += cost
+                    done_jobs += 1
+                    report_progress()
+                else:
+                    # Any of these jobs may have killed the worker, retry each of them on its own
+                    print(f"A worker process died while running {', '.join(name for name, _, _ in lost)}, "
+                          f"retrying them one at a time")
+                    run_alone.update(name for name, _, _ in lost)
+                    pending = sorted(pending + lost, key=lambda job: job[1], reverse=True)
+    finally:
+        executor.shutdown()
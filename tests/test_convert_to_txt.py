@@ -0,0 +1,49 @@
+import json
+import os
+
+from convert_to_txt import convert_st_to_txt_files
+
+HEADER = "// ====\n// Converted from: {name}.pdf\n// ====\n\n"
+BODY = "NETWORK 1:\n    a := b;\n"
+
+
+def write_st(source_dir, name, body=BODY):
+    (source_dir / "OBs").mkdir(parents=True, exist_ok=True)
+    with open(source_dir / "OBs" / f"{name}.st", 'w', encoding='utf-8') as f:
+        f.write(HEADER.format(name=name) + body)
+
+
+def read_dedup_map(output_dir):
+    with open(output_dir / "dedup_map.json", encoding='utf-8') as f:
+        return json.load(f)['blocks']
+
+
+def test_duplicates_keep_their_header_and_reference_the_converted_file(tmp_path):
+    source_dir, output_dir = tmp_path / "src", tmp_path / "out"
+    write_st(source_dir, "A")
+    write_st(source_dir, "B")
+
+    convert_st_to_txt_files(source_dir, output_dir, max_workers=1)
+
+    with open(output_dir / "OBs_B.txt", encoding='utf-8') as f:
+        stub = f.read()
+    assert "// Converted from: B.pdf" in stub
+    assert "// DUPLICATE: identical to OBs_A.txt" in stub
+    assert read_dedup_map(output_dir)["OBs_B"]['status'] == 'duplicate'
+
+
+def test_duplicates_of_a_failed_file_are_marked_failed(tmp_path):
+    source_dir, output_dir = tmp_path / "src", tmp_path / "out"
+    write_st(source_dir, "A")
+    write_st(source_dir, "B")
+    output_dir.mkdir()
+    # Writing OBs_A.txt through a dangling link makes the conversion of A fail
+    os.symlink(tmp_path / "missing" / "OBs_A.txt", output_dir / "OBs_A.txt")
+
+    convert_st_to_txt_files(source_dir, output_dir, max_workers=1)
+
+    blocks = read_dedup_map(output_dir)
+    assert blocks["OBs_A"]['status'] == 'failed'
+    assert blocks["OBs_B"]['status'] == 'failed'
+    assert blocks["OBs_B"]['reference_failed'] is True
+    assert not (output_dir / "OBs_B.txt").exists()
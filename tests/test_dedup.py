@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from dedup import create_dedup_map, fingerprint_block, parse_reference
+from pdf_to_structured_text import deduplicate_converted_blocks, write_structured_text_file
+
+BASE = ''.join(f"NETWORK {i}:\n    x{i} := y{i};\n\n" for i in range(20))
+VARIANT = BASE.replace("x3 ", "z3 ")
+
+
+def convert(output_dir, pdf_name, content):
+    """Write a block the way a worker does and return its (metadata, fingerprint) result."""
+    pdf_file = Path(pdf_name)
+    output_subdir = output_dir / "FBs"
+    output_subdir.mkdir(parents=True, exist_ok=True)
+    write_structured_text_file(output_subdir / f"{pdf_file.stem}.st", pdf_file, "FBs", {}, content)
+    return {}, fingerprint_block(content)
+
+
+def read_reference(output_dir, stem):
+    with open(output_dir / "FBs" / f"{stem}.st", encoding='utf-8') as f:
+        body = f.read().split("// " + "=" * 76 + "\n\n", 1)[1]
+    return parse_reference(body)
+
+
+def test_byte_identical_near_duplicates_reuse_the_group_outcome(tmp_path):
+    # Only the first PDF of a byte-identical group is converted, so B2 has no .st file yet
+    results = {
+        "A (FB).pdf": convert(tmp_path, "A (FB).pdf", BASE),
+        "B1 (FB).pdf": convert(tmp_path, "B1 (FB).pdf", VARIANT),
+    }
+    groups_by_job = {
+        "A (FB).pdf": [Path("A (FB).pdf")],
+        "B1 (FB).pdf": [Path("B1 (FB).pdf"), Path("B2 (FB).pdf")],
+    }
+    dedup_map = create_dedup_map()
+
+    deduplicate_converted_blocks(tmp_path, groups_by_job, results, dedup_map)
+
+    assert dedup_map['blocks']["FBs_B1 (FB)"]['status'] == 'near_duplicate'
+    assert dedup_map['blocks']["FBs_B2 (FB)"]['status'] == 'near_duplicate'
+    assert read_reference(tmp_path, "B1 (FB)") == ('near_duplicate', "FBs_A (FB)")
+    assert read_reference(tmp_path, "B2 (FB)") == ('near_duplicate', "FBs_A (FB)")
+
+
+def test_byte_identical_copies_of_a_unique_block_reference_the_first_copy(tmp_path):
+    results = {"B1 (FB).pdf": convert(tmp_path, "B1 (FB).pdf", BASE)}
+    groups_by_job = {"B1 (FB).pdf": [Path("B1 (FB).pdf"), Path("B2 (FB).pdf")]}
+    dedup_map = create_dedup_map()
+
+    deduplicate_converted_blocks(tmp_path, groups_by_job, results, dedup_map)
+
+    assert dedup_map['blocks']["FBs_B1 (FB)"]['status'] == 'unique'
+    assert read_reference(tmp_path, "B1 (FB)") is None
+    assert read_reference(tmp_path, "B2 (FB)") == ('duplicate', "FBs_B1 (FB)")
+
+
+def test_near_duplicate_diff_is_labelled_relative_to_the_block_body(tmp_path):
+    results = {
+        "A (FB).pdf": convert(tmp_path, "A (FB).pdf", BASE),
+        "B (FB).pdf": convert(tmp_path, "B (FB).pdf", VARIANT),
+    }
+    groups_by_job = {name: [Path(name)] for name in results}
+    dedup_map = create_dedup_map()
+
+    deduplicate_converted_blocks(tmp_path, groups_by_job, results, dedup_map)
+
+    with open(tmp_path / "FBs" / "B (FB).st", encoding='utf-8') as f:
+        stub = f.read()
+    assert "--- FBs_A (FB) (block body)" in stub
+    assert "+++ FBs_B (FB) (block body)" in stub
+    # Line 11 of the block body is the changed assignment of network 3, with 3 lines of context
+    assert BASE.splitlines()[10] == "    x3 := y3;"
+    assert "@@ -8,7 +8,7 @@" in stub